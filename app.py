@@ -2,14 +2,44 @@ import streamlit as st
 import os
 import csv
 import json
+import asyncio
+import atexit
+import queue
+import sys
+import threading
+import time
+import itertools
+import hashlib
+import re
+import html
+from collections import deque
 from datetime import datetime
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 from langchain_groq import ChatGroq
-from tavily import TavilyClient
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import RunnableLambda
+from groq import RateLimitError
+from tavily import TavilyClient, AsyncTavilyClient, UsageLimitExceededError
+from tenacity import retry, wait_exponential_jitter, stop_after_attempt, retry_if_exception_type
 
 # --- PAGE CONFIGURATION (Must be the first Streamlit command) ---
 st.set_page_config(layout="wide", page_title="Agent Verification Lab")
 
+# --- READER MODE STYLES ---
+# Sent once at the top of the page so each Reader Mode block only carries its class names
+st.markdown(
+    """
+    <style>
+    .reader { border: 1px solid #ddd; border-radius: 8px; padding: 20px; height: 400px; overflow-y: auto; background-color: #f9f9f9; color: #2c3e50; font-family: 'Arial', sans-serif; font-size: 15px; line-height: 1.6; box-shadow: inset 0 0 10px rgba(0,0,0,0.05); }
+    .reader mark { background-color: #ffeb3b; color: #000; padding: 0 4px; border-radius: 4px; font-weight: bold; box-shadow: 0 0 5px #ffeb3b; }
+    </style>
+    """,
+    unsafe_allow_html=True
+)
+
 # --- SECURITY SETUP ---
 load_dotenv()
 
@@ -20,25 +50,384 @@ if not GROQ_API_KEY or not TAVILY_API_KEY:
     st.error("🚨 API Keys not found! Make sure you have created a .env file.")
     st.stop()
 
-# --- INITIALIZE CLIENTS ---
-llm = ChatGroq(temperature=0, model_name="llama-3.3-70b-versatile", groq_api_key=GROQ_API_KEY)
-tavily = TavilyClient(api_key=TAVILY_API_KEY)
+# --- INITIALIZE CLIENTS (cached once per server process, reused across reruns) ---
+MAX_OUTPUT_TOKENS = 200 # <-- TWO-SENTENCE CLAIM + ONE QUOTED SENTENCE, WRAPPED IN JSON
+
+# Claim extraction is extractive, so the 8B model is the default; 70B stays selectable in Step 1
+GROQ_MODELS = ["llama-3.1-8b-instant", "llama-3.3-70b-versatile"]
+
+# Client-side tokens-per-minute cap per model, for keys on a tier low enough to hit 429s on a full
+# queue (Groq's free tier is 6000 for 8B and 12000 for 70B). Off by default; 429s are still retried.
+GROQ_TPM_LIMIT = int(os.getenv("GROQ_TPM_LIMIT", "0"))
+
+MAX_POOL_CONNECTIONS = 20 # <-- KEEP-ALIVE CONNECTIONS PER HTTP POOL
+
+@st.cache_resource
+def get_groq_http_client():
+    # One HTTP/2 pool shared by every Groq model: concurrent batch calls multiplex over the same
+    # TLS connection, and switching between 8B and 70B doesn't open a new one
+    return httpx.Client(
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=MAX_POOL_CONNECTIONS),
+        timeout=httpx.Timeout(60.0, connect=5.0)
+    )
+
+@st.cache_resource
+def get_llm(model_name):
+    return ChatGroq(temperature=0, model_name=model_name, max_tokens=MAX_OUTPUT_TOKENS, groq_api_key=GROQ_API_KEY, http_client=get_groq_http_client())
+
+@st.cache_resource
+def get_tavily():
+    # TavilyClient is built on requests rather than httpx, so it gets its own pooled keep-alive session
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_maxsize=MAX_POOL_CONNECTIONS))
+    return TavilyClient(api_key=TAVILY_API_KEY, session=session)
+
+tavily = get_tavily()
 
 # --- CSV LOGGING SETUP ---
-CSV_FILE = "experiment_results3.csv"
-
-if not os.path.exists(CSV_FILE):
-    with open(CSV_FILE, "w", newline="", encoding="utf-8") as f:
-        writer = csv.writer(f)
-        writer.writerow([
-            "timestamp",
-            "topic",
-            "agent_claim",
-            "source_url",
-            "human_verdict",
-            "verification_mode",
-            "verification_time_seconds" # <-- NEW COLUMN FOR THE TIMER
-        ])
+# v4 adds the agent model, so 8B and 70B claims can be separated within each verification mode
+CSV_FILE = "experiment_results4.csv"
+REPEATS_FILE = "experiment_repeats4.csv" # <-- SAME SCHEMA, FOR (topic, source, mode, model) ALREADY LOGGED THIS SESSION
+
+for log_file in (CSV_FILE, REPEATS_FILE):
+    if not os.path.exists(log_file):
+        with open(log_file, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow([
+                "timestamp",
+                "topic",
+                "agent_claim",
+                "source_urls", # <-- SPACE-SEPARATED, ONE PER SOURCE IN THE PROMPT
+                "human_verdict",
+                "verification_mode",
+                "verification_time_seconds", # <-- NEW COLUMN FOR THE TIMER
+                "model"
+            ])
+
+LOG_QUEUE_SIZE = 1024 # <-- ROWS WAITING FOR THE WRITER BEFORE put() BLOCKS
+LOG_BATCH_SIZE = 64 # <-- MAX ROWS PER write(2)
+
+def _drain(log_queue):
+    fds = {}
+    while True:
+        batch = [log_queue.get()]
+        while len(batch) < LOG_BATCH_SIZE:
+            try:
+                batch.append(log_queue.get_nowait())
+            except queue.Empty:
+                break
+
+        # Each row carries its session's error list, so a failure is only reported to the sessions it hit
+        lines_by_file, errors_by_file = {}, {}
+        for log_file, line, log_errors in batch:
+            lines_by_file.setdefault(log_file, []).append(line)
+            errors_by_file.setdefault(log_file, {})[id(log_errors)] = log_errors
+
+        try:
+            for log_file, lines in lines_by_file.items():
+                try:
+                    if log_file not in fds:
+                        fds[log_file] = os.open(log_file, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+                    # O_APPEND makes each batch a single atomic append at the current end of file
+                    data = "".join(lines).encode("utf-8")
+                    written = os.write(fds[log_file], data)
+                    if written != len(data):
+                        raise OSError(f"short write ({written} of {len(data)} bytes)")
+                    os.fsync(fds[log_file])
+                except OSError as e:
+                    # Keep the thread alive so later rows (and the exit-time join) aren't stuck behind this one
+                    message = f"Failed to write {len(lines)} row(s) to {log_file}: {e}"
+                    print(f"🚨 {message}", file=sys.stderr)
+                    for log_errors in errors_by_file[log_file].values():
+                        log_errors.append(message)
+                    fd = fds.pop(log_file, None)
+                    if fd is not None:
+                        os.close(fd)
+        finally:
+            for _ in batch:
+                log_queue.task_done()
+
+@st.cache_resource
+def get_log_worker():
+    # Disk I/O happens on a daemon thread so a verdict click never waits on the file system
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    threading.Thread(target=_drain, args=(log_queue,), daemon=True).start()
+    atexit.register(log_queue.join) # let queued rows hit the disk before the process exits
+    return log_queue
+
+def q(s):
+    # Minimal CSV quoting for free-text fields; the rest of the row has a fixed, comma-free schema
+    return '"' + s.replace('"', '""') + '"'
+
+# --- RATE LIMITING ---
+CHARS_PER_TOKEN = 4 # <-- ROUGH ESTIMATE, GOOD ENOUGH FOR THROTTLING
+
+# Transient 429s from either API are retried with jittered exponential backoff instead of failing the run
+backoff = retry(
+    wait=wait_exponential_jitter(initial=1, max=30),
+    stop=stop_after_attempt(3),
+    retry=retry_if_exception_type((RateLimitError, UsageLimitExceededError)),
+    reraise=True
+)
+
+@st.cache_resource(show_spinner=False)
+def get_token_window(model_name):
+    # Shared by every session: the TPM limit applies to the API key and model, not to a browser tab.
+    # No spinner: the first call per model can come from a .batch() worker thread with no script context
+    return {"lock": threading.Lock(), "spent": deque()}
+
+def reserve_tokens(model_name, tokens):
+    # Block until the last minute of Groq usage leaves room for this request
+    if not GROQ_TPM_LIMIT:
+        return
+    window = get_token_window(model_name)
+    while True:
+        with window["lock"]:
+            now = time.monotonic()
+            while window["spent"] and now - window["spent"][0][0] > 60:
+                window["spent"].popleft()
+
+            if not window["spent"] or sum(t for _, t in window["spent"]) + tokens <= GROQ_TPM_LIMIT:
+                window["spent"].append((now, tokens))
+                return
+            wait = 60 - (now - window["spent"][0][0])
+        time.sleep(wait)
+
+def throttle(payload, model_name):
+    # Groq counts the max_tokens budget against TPM alongside the (truncated) prompt. Called once per
+    # item outside the retried call, so a 429 retry doesn't reserve the same request twice.
+    source_chars = min(len(payload["source_text"]), MAX_SOURCE_CHARS)
+    reserve_tokens(model_name, (len(PROMPT_TEMPLATE) + source_chars) // CHARS_PER_TOKEN + MAX_OUTPUT_TOKENS)
+    return payload
+
+# --- AGENT PIPELINE ---
+MAX_CONCURRENCY = 8 # <-- PARALLEL AGENT RUNS WHEN QUEUEING A WHOLE DATASET
+MAX_SOURCE_CHARS = 6000 # <-- ~1500 TOKENS OF SOURCE TEXT PER PROMPT
+MAX_SOURCES = 3 # <-- PAGES PER SEARCH, ALL RETURNED BY THE SAME TAVILY CALL
+
+# Added JSON instructions back in so the highlighter works!
+PROMPT_TEMPLATE = """
+System Instruction: You are a strict financial verification assistant. You will be provided with up to three numbered web sources ([1], [2], ...). You must adhere strictly to the following rules:
+1. Base your answer ONLY on these sources.
+2. Do not use any internal knowledge, external facts, or assumptions.
+3. Your final response must be exactly two sentences long.
+
+You MUST return your response as a valid JSON object with exactly two keys:
+"claim": "Your summary here",
+"exact_quote": "Copy and paste the EXACT word-for-word sentence from one of the sources that proves your claim, without its [n] marker. If you cannot find one, leave this empty."
+
+Sources:
+{source_text}
+"""
+
+def truncate(payload):
+    # Long pages only add prefill time for a two-sentence answer; the reader still shows the full text
+    return {"source_text": payload["source_text"][:MAX_SOURCE_CHARS]}
+
+@st.cache_resource
+def get_chain(model_name):
+    # The template is parsed once per server process; each run only fills in {source_text}.
+    # Every invoke/stream/batch item is truncated first.
+    return (
+        RunnableLambda(truncate)
+        | ChatPromptTemplate.from_template(PROMPT_TEMPLATE)
+        | get_llm(model_name)
+    )
+
+def gather_sources(search_result):
+    # Dedup by URL keeping the first (highest-ranked) hit, and split the prompt budget evenly across the sources
+    unique = {}
+    for r in search_result['results']:
+        unique.setdefault(r['url'], r)
+    sources = list(unique.values())[:MAX_SOURCES]
+    per_source = MAX_SOURCE_CHARS // len(sources)
+    return {
+        "urls": [r['url'] for r in sources],
+        "content": "\n\n".join(f"[{i}] {r['content']}" for i, r in enumerate(sources, 1)),
+        "source_text": "\n\n".join(f"[{i}] {r['content'][:per_source]}" for i, r in enumerate(sources, 1)),
+    }
+
+# Matches the (possibly still open) "claim" string of a partial JSON response
+CLAIM_VALUE = re.compile(r'"claim"\s*:\s*"((?:[^"\\]|\\.)*)')
+
+def stream_claim(chunks, parts):
+    # Yields only the claim text as it arrives; exact_quote is source evidence and stays off screen.
+    # Every raw chunk is collected in parts so the full response can still be parsed afterwards.
+    shown = ""
+    for chunk in chunks:
+        parts.append(chunk.content)
+        match = CLAIM_VALUE.search("".join(parts))
+        if not match:
+            continue
+        try:
+            claim = json.loads('"' + match.group(1).rstrip("\\") + '"')
+        except json.JSONDecodeError:
+            continue # a half-received escape sequence; the next chunk completes it
+        if len(claim) > len(shown):
+            yield claim[len(shown):]
+            shown = claim
+
+def parse_claim(response_text):
+    try:
+        clean_text = response_text.replace('```json', '').replace('```', '').strip()
+        parsed_data = json.loads(clean_text)
+        return parsed_data.get("claim", "Error extracting claim."), parsed_data.get("exact_quote", "")
+    except json.JSONDecodeError:
+        return response_text, ""
+
+@backoff
+def safe_search(topic):
+    return tavily.search(query=topic, search_depth="basic", max_results=MAX_SOURCES)
+
+@backoff
+def safe_invoke(model_name, payload):
+    return get_chain(model_name).invoke(payload).content
+
+@backoff
+def safe_stream(model_name, payload):
+    stream = get_chain(model_name).stream(payload)
+    # Rate-limit errors surface on the opening request, so pull the first chunk inside the retry
+    first = next(stream, None)
+    return itertools.chain([] if first is None else [first], stream)
+
+class NoResultsError(Exception):
+    pass
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def research(topic: str, model_name: str, live: bool) -> dict:
+    # Repeat topics skip both API calls; the streamed output below is replayed from the cache.
+    # live=False (Blind Mode) never streams, so nothing from the sources reaches the screen.
+    with st.spinner("Agent is searching the web..."):
+        search_result = safe_search(topic)
+
+    # Raised rather than returned: st.cache_data doesn't cache exceptions, so an empty
+    # or transient Tavily response is retried next time instead of replayed for an hour
+    if not search_result.get('results'):
+        raise NoResultsError(topic)
+
+    sources = gather_sources(search_result)
+    payload = throttle({"source_text": sources['source_text']}, model_name)
+    if live:
+        # Stream the claim to the screen as it arrives instead of blocking on the full response
+        st.caption("✍️ Agent is generating a claim...")
+        parts = []
+        st.write_stream(stream_claim(safe_stream(model_name, payload), parts))
+        response_text = "".join(parts)
+    else:
+        with st.spinner("Agent is generating a claim..."):
+            response_text = safe_invoke(model_name, payload)
+    ai_summary, exact_quote = parse_claim(response_text)
+
+    return {"topic": topic, "urls": sources['urls'], "content": sources['content'], "ai_summary": ai_summary, "exact_quote": exact_quote}
+
+@backoff
+async def search_one(client, semaphore, topic):
+    async with semaphore:
+        return await client.search(query=topic, search_depth="basic", max_results=MAX_SOURCES)
+
+async def search_all(topics):
+    # Every Tavily search is in flight at once instead of back-to-back
+    semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+    async with AsyncTavilyClient(api_key=TAVILY_API_KEY) as client:
+        # A failed search comes back as its exception so it doesn't cancel the rest of the queue
+        return await asyncio.gather(*[search_one(client, semaphore, t) for t in topics], return_exceptions=True)
+
+def run_agents(topics, model_name):
+    # Returns the finished runs plus (topic, reason) for every topic that was dropped
+    search_results = asyncio.run(search_all(topics))
+    found, failed = [], []
+    for topic, r in zip(topics, search_results):
+        if isinstance(r, Exception):
+            failed.append((topic, r))
+        elif not r.get('results'):
+            failed.append((topic, "no results"))
+        else:
+            found.append((topic, gather_sources(r)))
+    if not found:
+        return [], failed
+
+    # One batched chain call fans the claims out to Groq in parallel. The sync batch runs on a
+    # thread pool: the async client's connection pool can't outlive the asyncio.run() loop above.
+    # with_retry is tenacity-backed too, and only re-sends the items that hit a 429; the throttle
+    # sits in front of it so each item reserves its tokens once
+    responses = (RunnableLambda(lambda payload: throttle(payload, model_name)) | get_chain(model_name).with_retry(
+        retry_if_exception_type=(RateLimitError,),
+        wait_exponential_jitter=True,
+        stop_after_attempt=3
+    )).batch(
+        [{"source_text": sources['source_text']} for _, sources in found],
+        config={"max_concurrency": MAX_CONCURRENCY},
+        return_exceptions=True # keep the claims that already came back if one item fails
+    )
+
+    runs = []
+    for (topic, sources), response in zip(found, responses):
+        if isinstance(response, Exception):
+            failed.append((topic, response))
+            continue
+        ai_summary, exact_quote = parse_claim(response.content)
+        runs.append({"topic": topic, "urls": sources['urls'], "content": sources['content'], "ai_summary": ai_summary, "exact_quote": exact_quote})
+    return runs, failed
+
+def queue_runs(topics, model_name):
+    # Research every topic up front, then review the prefetched runs one by one
+    try:
+        with st.spinner(f"Agent is researching {len(topics)} topics in parallel..."):
+            runs, failed = run_agents(topics, model_name)
+
+        # Kept in session state: a successful queue swaps Step 1 for the lock notice, which shows these
+        st.session_state.skipped = [f"{topic}: {reason}" for topic, reason in failed]
+
+        if not runs:
+            st.error("No results found for any of these topics.")
+            st.warning("\n\n".join(f"- {s}" for s in st.session_state.skipped))
+            return
+
+        st.session_state.queue = runs[1:]
+        start_review(runs[0])
+
+    except Exception as e:
+        st.error(f"Error: {e}")
+
+def new_run(experiment_mode, agent_model):
+    # Any runs still queued were prefetched under the previous mode and model, so they're dropped
+    st.session_state.experiment_mode = experiment_mode
+    st.session_state.agent_model = agent_model
+    st.session_state.queue = []
+
+def start_review(run):
+    st.session_state.topic = run["topic"]
+    # Only the two fields the UI reads are kept, not the whole Tavily result
+    st.session_state.urls = run["urls"]
+    st.session_state.content = run["content"]
+    st.session_state.ai_summary = run["ai_summary"]
+    st.session_state.exact_quote = run["exact_quote"]
+    # Dedup key for the results log, computed once per claim rather than at click time. Mode and model
+    # are part of it, so rerunning a topic under the other arm still goes to the main log.
+    key = f"{run['topic']}|{' '.join(run['urls'])}|{st.session_state.experiment_mode}|{st.session_state.agent_model}"
+    st.session_state.log_key = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+    # --- START TIMER EXACTLY WHEN THE CLAIM IS SHOWN ---
+    st.session_state.start_time = datetime.now()
+    st.session_state.stage = 1
+
+# --- READER MODE ---
+READER_CACHE_ENTRIES = 32 # <-- SOURCE PAGES KEPT RENDERED IN MEMORY, ACROSS ALL SESSIONS
+
+def sanitize(text: str) -> str:
+    # Scraped pages go into unsafe_allow_html markdown, so escape them. Only called from the cached
+    # render_reader below, so each page is escaped once per (content, quote) pair, not per rerun.
+    return html.escape(text).replace("\n", "<br>")
+
+@st.cache_data(ttl=3600, max_entries=READER_CACHE_ENTRIES, show_spinner=False)
+def render_reader(content: str, quote: str) -> str:
+    # Built once per (content, quote) pair instead of on every rerun of Step 2
+    highlighted_content = sanitize(content)
+    if quote and quote in content:
+        safe_quote = sanitize(quote)
+        highlighted_content = highlighted_content.replace(safe_quote, f'<mark>{safe_quote}</mark>')
+
+    return f'<div class="reader">{highlighted_content}</div>'
 
 # --- UI HEADER ---
 st.title("🕵️ Source-Grounded Agent (HITL)")
@@ -46,216 +435,248 @@ st.markdown("### Human-in-the-Loop Verification Experiment")
 st.markdown("---")
 
 # --- SESSION STATE MANAGEMENT ---
-if "step" not in st.session_state: st.session_state.step = "input" 
+if "stage" not in st.session_state: st.session_state.stage = 0 # <-- 0 = INPUT, 1 = REVIEW, 2 = VERIFIED
 if "topic" not in st.session_state: st.session_state.topic = ""
-if "research_data" not in st.session_state: st.session_state.research_data = None
+if "urls" not in st.session_state: st.session_state.urls = []
+if "content" not in st.session_state: st.session_state.content = ""
 if "ai_summary" not in st.session_state: st.session_state.ai_summary = ""
 if "exact_quote" not in st.session_state: st.session_state.exact_quote = ""
 if "verification_status" not in st.session_state: st.session_state.verification_status = None
 if "experiment_mode" not in st.session_state: st.session_state.experiment_mode = "Source-Grounded (Experimental)"
+if "agent_model" not in st.session_state: st.session_state.agent_model = "llama-3.1-8b-instant"
 if "start_time" not in st.session_state: st.session_state.start_time = None # <-- TIMER START STATE
 if "verification_time" not in st.session_state: st.session_state.verification_time = None # <-- TIMER END STATE
+if "queue" not in st.session_state: st.session_state.queue = [] # <-- PREFETCHED RUNS WAITING FOR REVIEW
+if "log_key" not in st.session_state: st.session_state.log_key = ""
+if "seen" not in st.session_state: st.session_state.seen = set() # <-- LOG KEYS ALREADY WRITTEN TO CSV_FILE
+if "log_errors" not in st.session_state: st.session_state.log_errors = [] # <-- THIS SESSION'S FAILED LOG WRITES
+if "skipped" not in st.session_state: st.session_state.skipped = [] # <-- QUEUED TOPICS THAT FAILED TO RESEARCH
 
-# --- STEP 1: INPUT PHASE ---
-if st.session_state.step == "input":
-    st.header("Step 1: Define Research Topic")
-    
-    # 1. Experiment Mode Toggle (For A/B Testing)
-    st.session_state.experiment_mode = st.radio(
-        "Select Experiment Mode:",
-        ["Blind Mode (Control)", "Source-Grounded (Experimental)"],
-        horizontal=True
+# --- PAGE LAYOUT ---
+# All three steps share one page and are rendered top to bottom in a single script run, so a
+# transition made in an earlier step shows up in the later ones without an st.rerun(). Each
+# step's expander lives in its own placeholder, which can also be refilled or cleared in place.
+input_slot = st.empty()
+review_slot = st.empty()
+log_slot = st.empty()
+
+def log_to_csv(verdict):
+    # --- STOP TIMER AND CALCULATE SECONDS ---
+    if st.session_state.start_time:
+        time_taken = round((datetime.now() - st.session_state.start_time).total_seconds(), 2)
+    else:
+        time_taken = 0.0
+    st.session_state.verification_time = time_taken
+
+    line = (
+        f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')},"
+        f"{q(st.session_state.topic)},"
+        f"{q(st.session_state.ai_summary)},"
+        f"{q(' '.join(st.session_state.urls))},"
+        f"{verdict},"
+        f"{st.session_state.experiment_mode},"
+        f"{time_taken}," # <-- RECORD THE TIME TO CSV
+        f"{st.session_state.agent_model}\r\n"
     )
-    st.write("---")
-    
-    # 2. Trap Question Loader (Dropdown)
-    trap_questions = []
-    dataset_file = "adversarial_dataset2.csv" if os.path.exists("adversarial_dataset2.csv") else "queries.csv"
-    
-    if os.path.exists(dataset_file):
-        with open(dataset_file, "r", encoding="utf-8") as f:
-            reader = csv.DictReader(f)
-            q_col = "Question" if "Question" in reader.fieldnames else "query"
-            trap_questions = [row[q_col] for row in reader if q_col in row]
-
-    if trap_questions:
-        use_dataset = st.checkbox(f"🧪 Load question from {dataset_file}", value=True)
-        if use_dataset:
-            topic_input = st.selectbox("Select a trap question:", trap_questions)
-        else:
-            topic_input = st.text_input("Enter a custom topic to research:")
+
+    # Re-running the same (topic, source) pair in the same mode and model goes to the repeats file, so the main log keeps one row per pair per arm
+    if st.session_state.log_key in st.session_state.seen:
+        get_log_worker().put((REPEATS_FILE, line, st.session_state.log_errors))
     else:
-        topic_input = st.text_input("Enter a topic to research:", placeholder="e.g., What was Nvidia's reported Data Center revenue in Q4 2024?")
-    
-    if st.button("🚀 Start Agent"):
-        if not topic_input:
-            st.warning("Please enter a topic.")
-        else:
-            with st.spinner("Agent is searching the web and generating a claim..."):
-                try:
-                    search_result = tavily.search(query=topic_input, search_depth="basic", max_results=1)
+        st.session_state.seen.add(st.session_state.log_key)
+        get_log_worker().put((CSV_FILE, line, st.session_state.log_errors))
+
+# Clicks rerun only this fragment, so logging the verdict doesn't first re-render the whole
+# page. A fragment can't write outside itself, so showing Step 3 takes one app-wide rerun.
+@st.fragment
+def verification_buttons():
+    c1, c2, c3 = st.columns(3)
+
+    if c1.button("✅ Approve"):
+        log_to_csv("Verified Accurate")
+        st.session_state.verification_status = "Verified Accurate"
+        st.session_state.stage = 2
+        st.rerun(scope="app")
+
+    if c2.button("❌ Reject"):
+        log_to_csv("Hallucination Detected")
+        st.session_state.verification_status = "Hallucination Detected"
+        st.session_state.stage = 2
+        st.rerun(scope="app")
+
+    if c3.button("🔄 Restart"):
+        st.session_state.queue = []
+        st.session_state.stage = 0
+        st.rerun(scope="app")
+
+def lock_input():
+    # Mode and model are fixed for the claim under review so Blind Mode stays blind
+    with input_slot.container(), st.expander("Step 1: Define Research Topic", expanded=bool(st.session_state.skipped)):
+        st.info("🔒 Finish verifying the current claim before starting a new topic.")
+        if st.session_state.skipped:
+            st.warning(f"⚠️ {len(st.session_state.skipped)} queued topics were skipped:\n\n" + "\n\n".join(f"- {s}" for s in st.session_state.skipped))
+
+def show_review():
+    with review_slot.container(), st.expander("Step 2: Human Verification Loop", expanded=True):
+        st.markdown(f"📌 **Original Research Question:** {st.session_state.topic}")
+        st.markdown("<br>", unsafe_allow_html=True)
+        
+        safe_summary = st.session_state.ai_summary.replace("$", "\$")
+        
+        # If Experimental Mode: Show Split Screen
+        if st.session_state.experiment_mode == "Source-Grounded (Experimental)":
+            col1, col2 = st.columns([1, 1])
+            
+            with col1:
+                st.subheader("🤖 AI Generated Claim")
+                st.info(safe_summary)
+                st.caption("The agent extracted this claim automatically.")
+
+            with col2:
+                st.subheader("📄 Source Context")
+                if st.session_state.content:
+                    st.markdown("**Source URLs:**\n" + "\n".join(f"{i}. [{url}]({url})" for i, url in enumerate(st.session_state.urls, 1)))
                     
-                    if not search_result.get('results'):
-                        st.error("No results found. Try a different topic.")
-                        st.stop()
-
-                    st.session_state.topic = topic_input
-                    st.session_state.research_data = search_result['results'][0]
-                    # UPDATED SYSTEM PROMPT
-                    source_text = st.session_state.research_data['content']
+                    content = st.session_state.content
+                    quote = st.session_state.get('exact_quote', '')
                     
-                    # Added JSON instructions back in so the highlighter works!
-                    prompt = f"""
-                    System Instruction: You are a strict financial verification assistant. You will be provided with a user query and raw source context. You must adhere strictly to the following rules:
-                    1. Base your answer solely on the provided raw context.
-                    2. Do not use any internal knowledge, external facts, or assumptions.
-                    3. Your final response must be exactly two sentences long.
+                    st.markdown(render_reader(content, quote), unsafe_allow_html=True)
                     
-                    You MUST return your response as a valid JSON object with exactly two keys:
-                    "claim": "Your summary here",
-                    "exact_quote": "Copy and paste the EXACT word-for-word sentence from the text that proves your claim. If you cannot find one, leave this empty."
+                    if not quote or quote not in content:
+                        st.caption("⚠️ *AI could not pinpoint an exact quote for this claim. Verify carefully!*")
+                    else:
+                        st.caption("✨ *Evidence automatically highlighted by the agent.*")
+                    
+        # If Control Mode: Hide the Reader Mode
+        else:
+            st.subheader("🤖 AI Generated Claim")
+            st.info(safe_summary)
+            st.caption("Standard AI View. Source links and evidence are hidden in Blind Mode. Please verify this claim based entirely on your own knowledge.")
+        
+        st.markdown("---")
+        st.write("### 🔍 Verification Decision")
+        verification_buttons()
 
-                    Text Context:
-                    {source_text}
-                    """
+def show_log():
+    next_topic = another_topic = False
+    with log_slot.container(), st.expander("Step 3: Verification Log", expanded=True):
+        if st.session_state.verification_status == "Verified Accurate":
+            st.success("✅ Success! The claim was approved.")
+        else:
+            st.error("⚠️ Correction! The human verifier rejected the claim.")
+            
+        log_data = {
+            "topic": st.session_state.topic,
+            "agent_claim": st.session_state.ai_summary,
+            "source_urls": st.session_state.urls,
+            "human_verdict": st.session_state.verification_status,
+            "mode_used": st.session_state.experiment_mode,
+            "model_used": st.session_state.agent_model,
+            "verification_time_seconds": st.session_state.verification_time # <-- SHOW TIME ON SCREEN
+        }
+        st.json(log_data)
 
-                    response = llm.invoke(prompt)
-                    
-                    try:
-                        clean_text = response.content.replace('```json', '').replace('```', '').strip()
-                        parsed_data = json.loads(clean_text)
-                        
-                        st.session_state.ai_summary = parsed_data.get("claim", "Error extracting claim.")
-                        st.session_state.exact_quote = parsed_data.get("exact_quote", "")
-                    except json.JSONDecodeError:
-                        st.session_state.ai_summary = response.content
-                        st.session_state.exact_quote = ""
-
-                    # --- START TIMER EXACTLY WHEN AGENT FINISHES ---
-                    st.session_state.start_time = datetime.now()
-                    st.session_state.step = "review"
-                    st.rerun()
+        # Failures are appended by the writer thread as they happen; each one is shown once
+        if st.session_state.log_errors:
+            st.warning("⚠️ Some verdicts could not be saved to disk:\n\n" + "\n\n".join(st.session_state.log_errors))
+            st.session_state.log_errors.clear()
+        
+        st.markdown("---")
+        if st.session_state.queue:
+            next_topic = st.button(f"⏭️ Next Queued Topic ({len(st.session_state.queue)} left)")
+        else:
+            another_topic = st.button("🔬 Test Another Topic")
 
-                except Exception as e:
-                    st.error(f"Error: {e}")
+    # Both transitions point back up the page, so the earlier placeholders are refilled in place
+    if next_topic:
+        log_slot.empty()
+        start_review(st.session_state.queue.pop(0))
+        lock_input()
+        show_review()
+    elif another_topic:
+        log_slot.empty()
+        st.session_state.stage = 0
 
-# --- STEP 2: VERIFICATION PHASE ---
-elif st.session_state.step == "review":
-    st.header("Step 2: Human Verification Loop")
-    
-    with st.expander("📌 View Original Research Question", expanded=True):
-        st.markdown(f"**{st.session_state.topic}**")
+# --- STEP 1: INPUT PHASE ---
+if st.session_state.stage != 1:
+    st.session_state.skipped = []
+    with input_slot.container(), st.expander("Step 1: Define Research Topic", expanded=True):
+        # 1. Experiment Mode Toggle (For A/B Testing)
+        experiment_mode = st.radio(
+            "Select Experiment Mode:",
+            ["Blind Mode (Control)", "Source-Grounded (Experimental)"],
+            horizontal=True
+        )
+
+        # Model Toggle: 8B is plenty for extracting a claim; switch to 70B for verification-critical runs
+        agent_model = st.radio(
+            "Select Agent Model:",
+            GROQ_MODELS,
+            horizontal=True
+        )
+        st.write("---")
         
-    st.markdown("<br>", unsafe_allow_html=True)
-    
-    safe_summary = st.session_state.ai_summary.replace("$", "\$")
-    
-    # If Experimental Mode: Show Split Screen
-    if st.session_state.experiment_mode == "Source-Grounded (Experimental)":
-        col1, col2 = st.columns([1, 1])
+        # 2. Trap Question Loader (Dropdown)
+        trap_questions = []
+        dataset_file = "adversarial_dataset2.csv" if os.path.exists("adversarial_dataset2.csv") else "queries.csv"
         
-        with col1:
-            st.subheader("🤖 AI Generated Claim")
-            st.info(safe_summary)
-            st.caption("The agent extracted this claim automatically.")
-
-        with col2:
-            st.subheader("📄 Source Context")
-            if st.session_state.research_data:
-                url = st.session_state.research_data['url']
-                st.markdown(f"**Source URL:** [{url}]({url})")
-                
-                content = st.session_state.research_data['content']
-                quote = st.session_state.get('exact_quote', '')
-                
-                if quote and quote in content:
-                    highlight_html = f'<mark style="background-color: #ffeb3b; color: #000; padding: 0 4px; border-radius: 4px; font-weight: bold; box-shadow: 0 0 5px #ffeb3b;">{quote}</mark>'
-                    highlighted_content = content.replace(quote, highlight_html)
-                else:
-                    highlighted_content = content 
-                
-                st.markdown(
-                    f"""
-                    <div style="border: 1px solid #ddd; border-radius: 8px; padding: 20px; height: 400px; overflow-y: auto; background-color: #f9f9f9; color: #2c3e50; font-family: 'Arial', sans-serif; font-size: 15px; line-height: 1.6; box-shadow: inset 0 0 10px rgba(0,0,0,0.05);">
-                        {highlighted_content}
-                    </div>
-                    """,
-                    unsafe_allow_html=True
-                )
-                
-                if not quote or quote not in content:
-                    st.caption("⚠️ *AI could not pinpoint an exact quote for this claim. Verify carefully!*")
-                else:
-                    st.caption("✨ *Evidence automatically highlighted by the agent.*")
-                
-    # If Control Mode: Hide the Reader Mode
-    else:
-        st.subheader("🤖 AI Generated Claim")
-        st.info(safe_summary)
-        st.caption("Standard AI View. Source links and evidence are hidden in Blind Mode. Please verify this claim based entirely on your own knowledge.")
-    
-    st.markdown("---")
-    st.write("### 🔍 Verification Decision")
-
-    def log_to_csv(verdict):
-        # --- STOP TIMER AND CALCULATE SECONDS ---
-        if st.session_state.start_time:
-            time_taken = round((datetime.now() - st.session_state.start_time).total_seconds(), 2)
+        if os.path.exists(dataset_file):
+            with open(dataset_file, "r", encoding="utf-8") as f:
+                reader = csv.DictReader(f)
+                q_col = "Question" if "Question" in reader.fieldnames else "query"
+                trap_questions = [row[q_col] for row in reader if q_col in row]
+
+        if trap_questions:
+            use_dataset = st.checkbox(f"🧪 Load question from {dataset_file}", value=True)
+            if use_dataset:
+                topic_input = st.selectbox("Select a trap question:", trap_questions)
+            else:
+                topic_input = st.text_input("Enter a custom topic to research:")
         else:
-            time_taken = 0.0
-        st.session_state.verification_time = time_taken
+            topic_input = st.text_input("Enter a topic to research:", placeholder="e.g., What was Nvidia's reported Data Center revenue in Q4 2024?")
+        
+        if st.button("🚀 Start Agent"):
+            if not topic_input:
+                st.warning("Please enter a topic.")
+            else:
+                try:
+                    new_run(experiment_mode, agent_model)
+                    # The streamed claim is only needed while it's being written
+                    progress = st.empty()
+                    with progress.container():
+                        run = research(topic_input, agent_model, experiment_mode == "Source-Grounded (Experimental)")
+                    progress.empty()
+                    start_review(run)
 
-        with open(CSV_FILE, "a", newline="", encoding="utf-8") as f:
-            writer = csv.writer(f)
-            writer.writerow([
-                datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                st.session_state.topic,
-                st.session_state.ai_summary,
-                st.session_state.research_data['url'],
-                verdict,
-                st.session_state.experiment_mode,
-                time_taken # <-- RECORD THE TIME TO CSV
-            ])
+                except NoResultsError:
+                    st.error("No results found. Try a different topic.")
+                except Exception as e:
+                    st.error(f"Error: {e}")
 
-    c1, c2, c3 = st.columns(3)
+        # 3. Batch Mode: research many topics in one go, then review them one by one
+        st.write("---")
+        if trap_questions and use_dataset:
+            if st.button(f"📚 Queue All {len(trap_questions)} Trap Questions"):
+                new_run(experiment_mode, agent_model)
+                queue_runs(trap_questions, agent_model)
 
-    if c1.button("✅ Approve"):
-        log_to_csv("Verified Accurate")
-        st.session_state.verification_status = "Verified Accurate"
-        st.session_state.step = "verified"
-        st.rerun()
+        batch_input = st.text_area("Or paste several topics to queue (one per line):")
+        batch_topics = [t.strip() for t in batch_input.splitlines() if t.strip()]
+        if st.button("📋 Queue Pasted Topics"):
+            if not batch_topics:
+                st.warning("Please enter at least one topic.")
+            else:
+                new_run(experiment_mode, agent_model)
+                queue_runs(batch_topics, agent_model)
 
-    if c2.button("❌ Reject"):
-        log_to_csv("Hallucination Detected")
-        st.session_state.verification_status = "Hallucination Detected"
-        st.session_state.step = "verified"
-        st.rerun()
+# Starting a run above swaps the inputs for the lock notice in place
+if st.session_state.stage == 1:
+    lock_input()
 
-    if c3.button("🔄 Restart"):
-        st.session_state.step = "input"
-        st.rerun()
+# --- STEP 2: VERIFICATION PHASE ---
+if st.session_state.stage == 1:
+    show_review()
 
 # --- STEP 3: LOGGING PHASE ---
-elif st.session_state.step == "verified":
-    st.header("Step 3: Verification Log")
-    
-    if st.session_state.verification_status == "Verified Accurate":
-        st.success("✅ Success! The claim was approved.")
-    else:
-        st.error("⚠️ Correction! The human verifier rejected the claim.")
-        
-    log_data = {
-        "topic": st.session_state.topic,
-        "agent_claim": st.session_state.ai_summary,
-        "source_url": st.session_state.research_data['url'],
-        "human_verdict": st.session_state.verification_status,
-        "mode_used": st.session_state.experiment_mode,
-        "verification_time_seconds": st.session_state.verification_time # <-- SHOW TIME ON SCREEN
-    }
-    st.json(log_data)
-    
-    st.markdown("---")
-    # FIXED BUTTON AND STATE RESET
-    if st.button("🔬 Test Another Topic"):
-        st.session_state.step = "input"
-        st.rerun()
\ No newline at end of file
+if st.session_state.stage == 2:
+    show_log()
@@ -3,8 +3,8 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 import sys
 
-# 1. Load the data
-file_name = "experiment_results3.csv"
+# 1. Load the data (defaults to the current results file; pass an older one to re-plot it)
+file_name = sys.argv[1] if len(sys.argv) > 1 else "experiment_results4.csv"
 try:
     df = pd.read_csv(file_name)
 except FileNotFoundError: